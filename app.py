@@ -5,20 +5,43 @@ A modern Flask web application for downloading Gmail attachments with OAuth2 int
 """
 
 import os
+from dotenv import load_dotenv
+
+# Load .env now so a GEVENT set there is seen before patching (config.py
+# loads it again later, which is harmless)
+load_dotenv()
+
+# Cooperative gevent workers: patch blocking I/O before anything else opens
+# sockets, so Gmail and database waits yield to other requests
+if os.getenv('GEVENT'):
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
 import base64
+import io
+import itertools
+import threading
 import zipfile as zf
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+from types import SimpleNamespace
+from urllib.parse import quote
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, send_file, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
+from flask_caching import Cache
+from sqlalchemy import event
+from sqlalchemy.orm import load_only
 from werkzeug.utils import secure_filename
-import tempfile
+from zipstream import ZipStream
 
 from config import Config
 from models import db, User, Attachment
 from gmail_oauth import GmailAPI
-from gmail_utils import clean_filename, format_file_size
+from gmail_utils import clean_filename, format_file_size, parse_email_date
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -26,7 +49,21 @@ app.config.from_object(Config)
 
 # Initialize extensions
 db.init_app(app)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling so readers don't block on commits and fsync less often."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+
 bcrypt = Bcrypt(app)
+cache = Cache(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'  # Changed from 'auth.login' to match actual route
 login_manager.login_message = 'Please log in to access this page.'
@@ -34,20 +71,164 @@ login_manager.login_message = 'Please log in to access this page.'
 # Initialize Gmail API using configured credential/token file names
 gmail_api = GmailAPI(
     credentials_file=app.config.get('GMAIL_CREDENTIALS_FILE', 'credentials.json'),
-    token_file=app.config.get('GMAIL_TOKEN_FILE', 'token.pickle')
+    token_file=app.config.get('GMAIL_TOKEN_FILE', 'token.json')
 )
 
+# Number of attachment rows sent per INSERT during Gmail imports
+ATTACHMENT_INSERT_BATCH_SIZE = 500
+
+# File types worth deflating when building ZIP archives; everything else
+# (pdf, images, office documents, archives, media) is already compressed
+COMPRESSIBLE_FILETYPES = frozenset({'txt', 'csv', 'log', 'html', 'json', 'xml', 'sql', 'md'})
+
+# File types safe to render inline in the browser
+PREVIEW_FILETYPES = frozenset({'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg', 'pdf', 'txt'})
+
+# Parallel unlink calls when removing a user's attachment files
+FILE_DELETE_WORKERS = 16
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
-@app.before_request
-def create_tables():
-    """Create database tables on first request."""
-    if not hasattr(app, 'tables_created'):
-        os.makedirs(app.config['ATTACHMENT_FOLDER'], exist_ok=True)
-        db.create_all()
-        app.tables_created = True
+def init_db():
+    """Create the attachment folder, database tables and any missing indexes."""
+    os.makedirs(app.instance_path, exist_ok=True)
+    os.makedirs(app.config['ATTACHMENT_FOLDER'], exist_ok=True)
+    db.create_all()
+    # create_all() skips indexes added to tables that already exist
+    for index in Attachment.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create database tables."""
+    init_db()
+    print('Database initialized.')
+
+# Initialize once at startup rather than on the request path. The pool is
+# disposed afterwards so preforked gunicorn workers don't share connections.
+with app.app_context():
+    init_db()
+    db.engine.dispose()
+
+def _download_message_attachments(message, user_id, import_run, thread_state):
+    """Download every attachment of one message; runs in a worker thread.
+
+    ``message`` holds the message's full details, as fetched by
+    GmailAPI.get_messages_details_batch. ``import_run`` carries the user
+    folder, timestamp, filename counter and attachment pool shared by the
+    whole import. Returns a list of attachment rows (plain dicts) and a
+    list of error messages. Each worker thread keeps its own GmailAPI copy
+    on ``thread_state`` since the underlying HTTP client is not thread-safe.
+    """
+    rows = []
+    errors = []
+
+    try:
+        # for_thread() may authenticate and build a service, so its failures
+        # are reported per message like any other
+        api = getattr(thread_state, 'api', None)
+        if api is None:
+            api = thread_state.api = gmail_api.for_thread(executor=import_run.attachment_executor)
+
+        message_id = message['id']
+
+        # Extract headers
+        headers = api.get_message_headers(message)
+        subject = headers.get('subject', 'No Subject')
+        sender = headers.get('from', 'Unknown Sender')
+        date_str = headers.get('date', '')
+
+        # Parse date
+        date_received = parse_email_date(date_str) if date_str else None
+
+        # Get attachments
+        attachments = api.get_attachments(message_id, message=message)
+
+        for attachment_data in attachments:
+            filename = clean_filename(attachment_data['filename'])
+            file_size = attachment_data.get('size', 0)
+
+            if 'error' in attachment_data:
+                errors.append(f"Failed to fetch: {filename} ({attachment_data['error']})")
+                continue
+
+            # Generate unique filename
+            safe_filename = f"{import_run.timestamp}_{next(import_run.sequence):05d}_{filename}"
+            file_path = os.path.join(import_run.user_folder, safe_filename)
+
+            # Download attachment
+            if api.download_attachment(attachment_data, file_path):
+                rows.append(dict(
+                    user_id=user_id,
+                    email_from=sender,
+                    subject=subject,
+                    filename=filename,
+                    filepath=file_path,
+                    filetype=os.path.splitext(filename)[1].lower().lstrip('.') or 'unknown',
+                    size=file_size,
+                    date_received=date_received
+                ))
+            else:
+                errors.append(f"Failed to download: {filename}")
+
+    except Exception as e:
+        errors.append(f"Error processing message: {str(e)}")
+
+    return rows, errors
+
+def _safe_unlink(path):
+    """Remove a file, returning 1 if it was deleted and 0 otherwise."""
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0  # Continue even if file deletion fails
+
+def _delete_files(paths):
+    """Delete files in parallel so slow filesystem metadata ops overlap.
+
+    Returns the number of files actually removed.
+    """
+    with ThreadPoolExecutor(max_workers=FILE_DELETE_WORKERS) as executor:
+        return sum(executor.map(_safe_unlink, paths))
+
+def _send_attachment(attachment, as_attachment):
+    """Send an attachment's file to the client.
+
+    With X_ACCEL_REDIRECT_PREFIX set, nginx serves the file from its internal
+    location and the worker only returns headers. Otherwise send_file is used,
+    which emits X-Sendfile itself when USE_X_SENDFILE is enabled. Either way
+    a missing file raises FileNotFoundError.
+    """
+    download_name = attachment.filename if as_attachment else os.path.basename(attachment.filepath)
+    prefix = app.config.get('X_ACCEL_REDIRECT_PREFIX')
+    if not prefix:
+        return send_file(attachment.filepath,
+                        as_attachment=as_attachment,
+                        download_name=download_name)
+
+    # nginx would answer a missing file with a bare 404, so check it here
+    stat = os.stat(attachment.filepath)
+
+    # Empty body: send_file still builds the type and Content-Disposition headers
+    response = send_file(io.BytesIO(), as_attachment=as_attachment,
+                         download_name=download_name, last_modified=stat.st_mtime)
+    rel_path = os.path.relpath(attachment.filepath, app.config['ATTACHMENT_FOLDER'])
+    response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(rel_path.replace(os.sep, '/'))
+    return response
+
+def _invalidate_user_cache(user_id):
+    """Drop cached dashboard API data after a user's attachments change."""
+    cache.delete_memoized(_user_stats, user_id)
+    cache.delete_memoized(_user_chart_data, user_id)
+
+def _conditional_json(data):
+    """Return a JSON response with an ETag, answering 304 when it matches."""
+    response = jsonify(data)
+    response.add_etag()
+    return response.make_conditional(request)
 
 # Routes
 @app.route('/')
@@ -132,39 +313,33 @@ def disconnect_gmail():
             if not revoke_success:
                 app.logger.warning("Failed to revoke Gmail OAuth token")
 
-        # Delete token file
-        token_file = app.config.get('GMAIL_TOKEN_FILE', 'token.pickle')
-        if os.path.exists(token_file):
+        # Delete token file (and any legacy pickled token)
+        for token_file in (gmail_api.token_file, gmail_api.legacy_token_file):
             try:
                 os.remove(token_file)
+            except FileNotFoundError:
+                pass
             except OSError as e:
                 app.logger.error(f"Failed to delete token file: {e}")
 
         # Delete all user attachments
-        attachments = Attachment.query.filter_by(user_id=current_user.id).all()
-        deleted_files = 0
-        for attachment in attachments:
-            if os.path.exists(attachment.filepath):
-                try:
-                    os.remove(attachment.filepath)
-                    deleted_files += 1
-                except OSError:
-                    pass  # Continue even if file deletion fails
+        attachments = Attachment.query.filter_by(user_id=current_user.id).with_entities(
+            Attachment.id, Attachment.filepath
+        ).all()
+        deleted_files = _delete_files(attachment.filepath for attachment in attachments)
 
         # Delete user directory if empty
         user_folder = os.path.join(app.config['ATTACHMENT_FOLDER'], str(current_user.id))
         try:
-            if os.path.exists(user_folder):
-                os.rmdir(user_folder)
+            os.rmdir(user_folder)
         except OSError:
             pass  # Directory not empty or doesn't exist
 
-        # Remove attachments from database
-        for attachment in attachments:
-            db.session.delete(attachment)
-
         try:
+            # Remove attachments from database in a single statement
+            db.session.execute(db.delete(Attachment).where(Attachment.user_id == current_user.id))
             db.session.commit()
+            _invalidate_user_cache(current_user.id)
         except Exception as e:
             db.session.rollback()
             app.logger.error(f"Database error during disconnect: {e}")
@@ -186,25 +361,24 @@ def delete_account():
     """Delete user account."""
     if request.method == 'POST':
         # Delete all attachments and their files
-        attachments = Attachment.query.filter_by(user_id=current_user.id).all()
-        for attachment in attachments:
-            if os.path.exists(attachment.filepath):
-                try:
-                    os.remove(attachment.filepath)
-                except OSError:
-                    pass  # Continue even if file deletion fails
+        attachments = Attachment.query.filter_by(user_id=current_user.id).with_entities(
+            Attachment.id, Attachment.filepath
+        ).all()
+        _delete_files(attachment.filepath for attachment in attachments)
 
         # Delete user directory if empty
         user_folder = os.path.join(app.config['ATTACHMENT_FOLDER'], str(current_user.id))
         try:
-            if os.path.exists(user_folder):
-                os.rmdir(user_folder)
+            os.rmdir(user_folder)
         except OSError:
             pass  # Directory not empty or doesn't exist
 
-        # Delete user from database
+        # Delete attachments in one statement, then the user
+        db.session.execute(db.delete(Attachment).where(Attachment.user_id == current_user.id))
+        user_id = current_user.id
         db.session.delete(current_user)
         db.session.commit()
+        _invalidate_user_cache(user_id)
 
         # Clear session and logout
         logout_user()
@@ -223,8 +397,10 @@ def dashboard():
         user_id=current_user.id
     ).order_by(Attachment.created_at.desc()).limit(5).all()
 
-    total_attachments = Attachment.query.filter_by(user_id=current_user.id).count()
-    total_size = db.session.query(db.func.sum(Attachment.size)).filter_by(user_id=current_user.id).scalar() or 0
+    total_attachments, total_size = db.session.query(
+        db.func.count(Attachment.id),
+        db.func.coalesce(db.func.sum(Attachment.size), 0)
+    ).filter_by(user_id=current_user.id).one()
 
     stats = {
         'total_attachments': total_attachments,
@@ -255,7 +431,7 @@ def gmail_auth():
     for tokens.
     """
     try:
-        redirect_uri = url_for('oauth2callback', _external=True)
+        redirect_uri = app.config.get('OAUTH2_REDIRECT_URI') or url_for('oauth2callback', _external=True)
         auth_url, state = gmail_api.get_authorization_url(redirect_uri)
         # Persist state for verification during callback
         session['oauth_state'] = state
@@ -274,7 +450,7 @@ def gmail_auth():
 def oauth2callback():
     """OAuth2 callback endpoint - exchange code for tokens and save credentials."""
     state = session.get('oauth_state')
-    redirect_uri = url_for('oauth2callback', _external=True)
+    redirect_uri = app.config.get('OAUTH2_REDIRECT_URI') or url_for('oauth2callback', _external=True)
 
     try:
         # request.url contains the full redirect URL including code and state
@@ -316,77 +492,51 @@ def gmail_connect():
 
             downloaded_count = 0
             errors = []
+            batch = []
+
+            # Gmail calls are network-bound, so fetch messages concurrently;
+            # rows are written to the database here on the request thread.
+            user_id = current_user.id
+            thread_state = threading.local()
+
+            # Create user-specific folder once; files are made unique with a
+            # per-import timestamp plus a counter
+            user_folder = os.path.join(app.config['ATTACHMENT_FOLDER'], str(user_id))
+            os.makedirs(user_folder, exist_ok=True)
+            import_run = SimpleNamespace(
+                user_folder=user_folder,
+                timestamp=datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+                sequence=itertools.count()
+            )
 
-            for message in messages:
-                try:
-                    message_id = message['id']
-
-                    # Get message details
-                    message_details = gmail_api.get_message_details(message_id)
-                    if not message_details:
-                        continue
-
-                    # Extract headers
-                    headers = gmail_api.get_message_headers(message_details)
-                    subject = headers.get('subject', 'No Subject')
-                    sender = headers.get('from', 'Unknown Sender')
-                    date_str = headers.get('date', '')
-
-                    # Parse date
-                    date_received = None
-                    if date_str:
-                        try:
-                            import email.utils
-                            date_tuple = email.utils.parsedate_tz(date_str)
-                            if date_tuple:
-                                ts = email.utils.mktime_tz(date_tuple)
-                                date_received = datetime.utcfromtimestamp(ts)
-                        except Exception:
-                            pass
-
-                    # Get attachments
-                    attachments = gmail_api.get_attachments(message_id)
-
-                    for attachment_data in attachments:
-                        filename = clean_filename(attachment_data['filename'])
-                        file_size = attachment_data.get('size', 0)
-
-                        # Create user-specific folder
-                        user_folder = os.path.join(
-                            app.config['ATTACHMENT_FOLDER'], 
-                            str(current_user.id)
-                        )
-                        os.makedirs(user_folder, exist_ok=True)
-
-                        # Generate unique filename
-                        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-                        safe_filename = f"{timestamp}_{filename}"
-                        file_path = os.path.join(user_folder, safe_filename)
-
-                        # Download attachment
-                        if gmail_api.download_attachment(attachment_data, file_path):
-                            # Save to database
-                            attachment = Attachment(
-                                user_id=current_user.id,
-                                email_from=sender,
-                                subject=subject,
-                                filename=filename,
-                                filepath=file_path,
-                                filetype=os.path.splitext(filename)[1].lower().lstrip('.') or 'unknown',
-                                size=file_size,
-                                date_received=date_received
-                            )
-                            db.session.add(attachment)
-                            downloaded_count += 1
-                        else:
-                            errors.append(f"Failed to download: {filename}")
-
-                except Exception as e:
-                    errors.append(f"Error processing message: {str(e)}")
-                    continue
+            # Fetch full message details in batched HTTP calls
+            details, failed = gmail_api.get_messages_details_batch([message['id'] for message in messages])
+            errors.extend(f"Failed to fetch message {message_id}: {error}"
+                          for message_id, error in failed.items())
+            candidates = [details[message['id']] for message in messages if message['id'] in details]
+
+            # Large attachments go through one bounded pool per import, shared
+            # by every download worker
+            with ThreadPoolExecutor(max_workers=app.config['GMAIL_ATTACHMENT_WORKERS']) as attachment_executor, \
+                    ThreadPoolExecutor(max_workers=app.config['GMAIL_DOWNLOAD_WORKERS']) as executor:
+                import_run.attachment_executor = attachment_executor
+                results = executor.map(
+                    lambda message: _download_message_attachments(message, user_id, import_run, thread_state),
+                    candidates
+                )
+                for rows, message_errors in results:
+                    errors.extend(message_errors)
+                    batch.extend(rows)
+                    downloaded_count += len(rows)
+                    if len(batch) >= ATTACHMENT_INSERT_BATCH_SIZE:
+                        Attachment.bulk_create(batch)
+                        batch.clear()
 
             try:
+                if batch:
+                    Attachment.bulk_create(batch)
                 db.session.commit()
+                _invalidate_user_cache(user_id)
                 if downloaded_count > 0:
                     flash(f'Successfully downloaded {downloaded_count} attachments!', 'success')
                 else:
@@ -416,7 +566,11 @@ def history():
     search = request.args.get('search', '').strip()
     file_type = request.args.get('type', '').strip()
 
-    query = Attachment.query.filter_by(user_id=current_user.id)
+    # Only load the columns the history table renders
+    query = Attachment.query.filter_by(user_id=current_user.id).options(load_only(
+        Attachment.id, Attachment.filename, Attachment.subject, Attachment.email_from,
+        Attachment.filetype, Attachment.size, Attachment.created_at
+    ))
 
     # Apply filters
     if search:
@@ -457,14 +611,11 @@ def download(attach_id):
         flash('Access denied.', 'danger')
         return redirect(url_for('history'))
 
-    if not os.path.exists(attachment.filepath):
+    try:
+        return _send_attachment(attachment, as_attachment=True)
+    except FileNotFoundError:
         flash('File not found on server.', 'danger')
         return redirect(url_for('history'))
-
-    try:
-        return send_file(attachment.filepath,
-                        as_attachment=True,
-                        download_name=attachment.filename)
     except Exception as e:
         flash(f'Error downloading file: {str(e)}', 'danger')
         app.logger.error(f"Download error: {e}")
@@ -480,19 +631,16 @@ def preview(attach_id):
         flash('Access denied.', 'danger')
         return redirect(url_for('history'))
 
-    if not os.path.exists(attachment.filepath):
-        flash('File not found on server.', 'danger')
-        return redirect(url_for('history'))
-
     # Optional: Restrict preview to safe file types for security
-    safe_types = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg', 'pdf', 'txt'}
-    if attachment.filetype.lower() not in safe_types:
+    if (attachment.filetype or '').lower() not in PREVIEW_FILETYPES:
         flash('Preview not available for this file type.', 'warning')
         return redirect(url_for('history'))
 
     try:
-        return send_file(attachment.filepath,
-                        as_attachment=False)
+        return _send_attachment(attachment, as_attachment=False)
+    except FileNotFoundError:
+        flash('File not found on server.', 'danger')
+        return redirect(url_for('history'))
     except Exception as e:
         flash(f'Error previewing file: {str(e)}', 'danger')
         app.logger.error(f"Preview error: {e}")
@@ -502,40 +650,33 @@ def preview(attach_id):
 @login_required
 def download_zip():
     """Download all attachments as ZIP file."""
-    attachments = Attachment.query.filter_by(user_id=current_user.id).all()
+    attachments = db.session.query(
+        Attachment.filepath, Attachment.filename, Attachment.filetype
+    ).filter_by(user_id=current_user.id).all()
 
     if not attachments:
         flash('No attachments to download.', 'warning')
         return redirect(url_for('history'))
 
-    # Create temporary ZIP file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-
-    try:
-        with zf.ZipFile(temp_zip.name, 'w', zf.ZIP_DEFLATED) as zip_file:
-            for attachment in attachments:
-                if os.path.exists(attachment.filepath):
-                    # Use original filename in ZIP
-                    zip_file.write(attachment.filepath, attachment.filename)
-
-        # Generate download filename
-        download_name = f"gmail_attachments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-
-        return send_file(temp_zip.name, 
-                        as_attachment=True, 
-                        download_name=download_name,
-                        mimetype='application/zip')
-
-    except Exception as e:
-        flash(f'Error creating ZIP file: {str(e)}', 'danger')
-        app.logger.error(f"ZIP creation error: {e}")
-        return redirect(url_for('history'))
-    finally:
-        # Clean up temp file
+    # Build the archive lazily so bytes are streamed straight to the client.
+    # Most attachment formats are already compressed, so only deflate text.
+    zip_stream = ZipStream(compress_type=zf.ZIP_STORED)
+    for attachment in attachments:
+        compress_type = zf.ZIP_DEFLATED if attachment.filetype in COMPRESSIBLE_FILETYPES else zf.ZIP_STORED
         try:
-            os.unlink(temp_zip.name)
-        except:
-            pass
+            # Use original filename in ZIP
+            zip_stream.add_path(attachment.filepath, attachment.filename, compress_type=compress_type)
+        except FileNotFoundError:
+            continue
+
+    # Generate download filename
+    download_name = f"gmail_attachments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+
+    return Response(
+        zip_stream,
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
 
 @app.route('/delete/<int:attach_id>', methods=['POST'])
 @login_required
@@ -549,12 +690,15 @@ def delete(attach_id):
 
     try:
         # Remove file from disk
-        if os.path.exists(attachment.filepath):
+        try:
             os.remove(attachment.filepath)
+        except FileNotFoundError:
+            pass
 
         # Remove from database
         db.session.delete(attachment)
         db.session.commit()
+        _invalidate_user_cache(current_user.id)
 
         flash('Attachment deleted successfully.', 'success')
 
@@ -573,100 +717,105 @@ def api_gmail_status():
     authenticated = session.get('gmail_authenticated', False)
     return jsonify({'authenticated': authenticated})
 
+@cache.memoize()
+def _user_stats(user_id):
+    """Attachment totals for a user, cached until the user's attachments change."""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0)
+    total_attachments, recent_count = db.session.query(
+        db.func.count(Attachment.id),
+        db.func.coalesce(db.func.sum(db.case((Attachment.created_at >= today, 1), else_=0)), 0)
+    ).filter_by(user_id=user_id).one()
+    return {'total': total_attachments, 'recent': recent_count}
+
 @app.route('/api/stats')
 @login_required
 def api_stats():
     """Get user statistics."""
-    total_attachments = Attachment.query.filter_by(user_id=current_user.id).count()
-    recent_count = Attachment.query.filter_by(user_id=current_user.id).filter(
-        Attachment.created_at >= datetime.utcnow().replace(hour=0, minute=0, second=0)
-    ).count()
+    stats = _user_stats(current_user.id)
 
-    return jsonify({
-        'total': total_attachments,
-        'recent': recent_count,
+    return _conditional_json({
+        'total': stats['total'],
+        'recent': stats['recent'],
         'gmail_connected': session.get('gmail_authenticated', False)
     })
 
+@cache.memoize()
+def _user_chart_data(user_id):
+    """Chart data for a user, cached until the user's attachments change."""
+    # File type distribution
+    file_types = db.session.query(
+        Attachment.filetype,
+        db.func.count(Attachment.id).label('count')
+    ).filter_by(user_id=user_id).group_by(Attachment.filetype).all()
+
+    file_type_labels = []
+    file_type_data = []
+    for ft, count in file_types:
+        file_type_labels.append(ft.upper() if ft else 'UNKNOWN')
+        file_type_data.append(count)
+
+    # Download trends (last 7 days)
+    from datetime import timedelta
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=7)
+
+    daily_downloads = db.session.query(
+        db.func.date(Attachment.created_at).label('date'),
+        db.func.count(Attachment.id).label('count')
+    ).filter(
+        Attachment.user_id == user_id,
+        Attachment.created_at >= start_date,
+        Attachment.created_at <= end_date
+    ).group_by(db.func.date(Attachment.created_at)).order_by(db.func.date(Attachment.created_at)).all()
+
+    trend_labels = []
+    trend_data = []
+    current_date = start_date.date()
+    while current_date <= end_date.date():
+        trend_labels.append(current_date.strftime('%b %d'))
+        count = next((item[1] for item in daily_downloads if item[0] == current_date), 0)
+        trend_data.append(count)
+        current_date += timedelta(days=1)
+
+    # Size distribution, bucketed by the database in a single query
+    size_labels = ['0-1MB', '1-10MB', '10-50MB', '50MB+']
+    size_bucket = db.case(
+        (Attachment.size < 1024*1024, '0-1MB'),
+        (Attachment.size < 10*1024*1024, '1-10MB'),
+        (Attachment.size < 50*1024*1024, '10-50MB'),
+        else_='50MB+'
+    ).label('bucket')
+    buckets = db.session.query(size_bucket).filter(
+        Attachment.user_id == user_id,
+        Attachment.size.isnot(None)
+    ).subquery()
+    size_counts = dict(db.session.query(
+        buckets.c.bucket,
+        db.func.count()
+    ).group_by(buckets.c.bucket).all())
+    size_data = [size_counts.get(label, 0) for label in size_labels]
+
+    return {
+        'file_types': {
+            'labels': file_type_labels,
+            'data': file_type_data
+        },
+        'download_trends': {
+            'labels': trend_labels,
+            'data': trend_data
+        },
+        'size_distribution': {
+            'labels': size_labels,
+            'data': size_data
+        }
+    }
+
 @app.route('/api/chart_data')
 @login_required
 def api_chart_data():
     """Get chart data for dashboard."""
     try:
-        # File type distribution
-        file_types = db.session.query(
-            Attachment.filetype,
-            db.func.count(Attachment.id).label('count')
-        ).filter_by(user_id=current_user.id).group_by(Attachment.filetype).all()
-
-        file_type_labels = []
-        file_type_data = []
-        for ft, count in file_types:
-            file_type_labels.append(ft.upper() if ft else 'UNKNOWN')
-            file_type_data.append(count)
-
-        # Download trends (last 7 days)
-        from datetime import timedelta
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=7)
-
-        daily_downloads = db.session.query(
-            db.func.date(Attachment.created_at).label('date'),
-            db.func.count(Attachment.id).label('count')
-        ).filter(
-            Attachment.user_id == current_user.id,
-            Attachment.created_at >= start_date,
-            Attachment.created_at <= end_date
-        ).group_by(db.func.date(Attachment.created_at)).order_by(db.func.date(Attachment.created_at)).all()
-
-        trend_labels = []
-        trend_data = []
-        current_date = start_date.date()
-        while current_date <= end_date.date():
-            trend_labels.append(current_date.strftime('%b %d'))
-            count = next((item[1] for item in daily_downloads if item[0] == current_date), 0)
-            trend_data.append(count)
-            current_date += timedelta(days=1)
-
-        # Size distribution
-        size_ranges = [
-            ('0-1MB', 0, 1024*1024),
-            ('1-10MB', 1024*1024, 10*1024*1024),
-            ('10-50MB', 10*1024*1024, 50*1024*1024),
-            ('50MB+', 50*1024*1024, float('inf'))
-        ]
-
-        size_labels = []
-        size_data = []
-        for label, min_size, max_size in size_ranges:
-            if max_size == float('inf'):
-                count = Attachment.query.filter(
-                    Attachment.user_id == current_user.id,
-                    Attachment.size >= min_size
-                ).count()
-            else:
-                count = Attachment.query.filter(
-                    Attachment.user_id == current_user.id,
-                    Attachment.size >= min_size,
-                    Attachment.size < max_size
-                ).count()
-            size_labels.append(label)
-            size_data.append(count)
-
-        return jsonify({
-            'file_types': {
-                'labels': file_type_labels,
-                'data': file_type_data
-            },
-            'download_trends': {
-                'labels': trend_labels,
-                'data': trend_data
-            },
-            'size_distribution': {
-                'labels': size_labels,
-                'data': size_data
-            }
-        })
+        return _conditional_json(_user_chart_data(current_user.id))
     except Exception as e:
         app.logger.error(f"Chart data error: {e}")
         return jsonify({'error': 'Failed to load chart data'}), 500
@@ -704,7 +853,4 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
 
-    with app.app_context():
-        db.create_all()
-
     app.run(host='0.0.0.0', port=port, debug=debug)
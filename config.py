@@ -3,6 +3,7 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from sqlalchemy.pool import StaticPool
 
 # Load environment variables
 load_dotenv()
@@ -53,25 +54,71 @@ class Config:
     SQLALCHEMY_DATABASE_URI = DATABASE_URL
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Connection pool settings
+    if SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        if ':memory:' in SQLALCHEMY_DATABASE_URI:
+            # An in-memory database only exists on its one connection
+            SQLALCHEMY_ENGINE_OPTIONS = {
+                'poolclass': StaticPool,
+                'connect_args': {'check_same_thread': False}
+            }
+        else:
+            # File databases keep SQLAlchemy's default QueuePool: one
+            # connection (and transaction) per thread, so WAL readers
+            # don't block on a writer
+            SQLALCHEMY_ENGINE_OPTIONS = {}
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            # gevent workers serve many requests per process, so pool more connections
+            'pool_size': int(os.getenv('DB_POOL_SIZE', '20' if os.getenv('GEVENT') else '10')),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+            'pool_pre_ping': True,
+            'pool_recycle': 1800
+        }
+
     # File upload settings
     ATTACHMENT_FOLDER = os.getenv('ATTACHMENT_FOLDER', str(basedir / 'static' / 'attachments'))
     MAX_ATTACHMENT_SIZE_MB = int(os.getenv('MAX_ATTACHMENT_SIZE_MB', '25'))
     MAX_CONTENT_LENGTH = MAX_ATTACHMENT_SIZE_MB * 1024 * 1024
 
+    # Let the fronting web server send attachment files instead of the
+    # Python worker: X-Sendfile (Apache/lighttpd) or X-Accel-Redirect (nginx,
+    # set to an internal location that maps to ATTACHMENT_FOLDER)
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+    X_ACCEL_REDIRECT_PREFIX = os.getenv('X_ACCEL_REDIRECT_PREFIX')
+
     # Gmail API settings
     GMAIL_CREDENTIALS_FILE = os.getenv('GMAIL_CREDENTIALS_FILE', 'credentials.json')
-    GMAIL_TOKEN_FILE = os.getenv('GMAIL_TOKEN_FILE', 'token.pickle')
+    GMAIL_TOKEN_FILE = os.getenv('GMAIL_TOKEN_FILE', 'token.json')
+    # Fixed OAuth callback URL (e.g. https://yourhost/oauth2callback); built from the request when unset
+    OAUTH2_REDIRECT_URI = os.getenv('OAUTH2_REDIRECT_URI')
+
+    # Number of messages fetched from Gmail in parallel during an import
+    GMAIL_DOWNLOAD_WORKERS = int(os.getenv('GMAIL_DOWNLOAD_WORKERS', '8'))
+    # Number of large attachments fetched in parallel during an import (one
+    # pool shared by all download workers)
+    GMAIL_ATTACHMENT_WORKERS = int(os.getenv('GMAIL_ATTACHMENT_WORKERS', '8'))
 
     # IMAP settings (fallback)
     IMAP_SERVER = os.getenv('IMAP_SERVER', 'imap.gmail.com')
     IMAP_PORT = int(os.getenv('IMAP_PORT', '993'))
 
     # Security settings
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
     WTF_CSRF_ENABLED = True
     SESSION_COOKIE_SECURE = os.getenv('FLASK_ENV') == 'production'
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
 
+    # Caching of per-user dashboard API data. The backend must be shared by
+    # all gunicorn workers so invalidation reaches every process: Redis when
+    # REDIS_URL is set, otherwise files under the instance folder
+    REDIS_URL = os.getenv('REDIS_URL')
+    CACHE_TYPE = os.getenv('CACHE_TYPE', 'RedisCache' if REDIS_URL else 'FileSystemCache')
+    CACHE_REDIS_URL = REDIS_URL or 'redis://localhost:6379/0'
+    CACHE_DIR = os.getenv('CACHE_DIR', str(basedir / 'instance' / 'cache'))
+    CACHE_DEFAULT_TIMEOUT = int(os.getenv('CACHE_DEFAULT_TIMEOUT', '60'))
+
     # Pagination
     POSTS_PER_PAGE = 20
 
@@ -91,7 +138,13 @@ class TestingConfig(Config):
     """Testing configuration."""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False}
+    }
     WTF_CSRF_ENABLED = False
+    CACHE_TYPE = 'NullCache'
+    BCRYPT_LOG_ROUNDS = 4
 
 # Configuration dictionary
 config = {
@@ -2,9 +2,16 @@
 
 import os
 import pickle
-import base64
+import binascii
 import json
+import threading
+import time
+from datetime import datetime, timedelta
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow, Flow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -16,30 +23,93 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.modify'
 ]
 
+# Base64 characters decoded per write (a multiple of 4 so every block is valid)
+DECODE_CHUNK_SIZE = 4096
+
+# Maps the URL-safe base64 alphabet used by Gmail onto the standard one
+_URLSAFE_TO_STANDARD = str.maketrans('-_', '+/')
+
+# Google OAuth endpoint for revoking tokens
+REVOKE_URL = 'https://oauth2.googleapis.com/revoke'
+
+# Shared session for direct OAuth HTTP calls (token refresh and revocation),
+# so repeated calls reuse the pooled TLS connection
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Refresh access tokens this long before they actually expire
+TOKEN_EXPIRY_BUFFER = timedelta(minutes=5)
+
+# Authorization flows keyed on (credentials path, mtime, redirect_uri, scopes);
+# rotating the credentials file changes the mtime and so builds a fresh flow
+_FLOW_CACHE = {}
+_FLOW_CACHE_LOCK = threading.Lock()
+
+def _get_flow(path, mtime, client_config, scopes, redirect_uri):
+    """Return the cached Flow for these client settings, building it on a miss.
+
+    ``client_config`` is the parsed credentials file as of ``mtime``. Callers
+    must hold _FLOW_CACHE_LOCK while using the returned flow, since it is
+    shared between requests.
+    """
+    key = (path, mtime, redirect_uri, tuple(scopes))
+    flow = _FLOW_CACHE.get(key)
+    if flow is None:
+        # Drop flows built from an older copy of the credentials file
+        for stale in [k for k in _FLOW_CACHE if k[0] == path and k[1] != mtime]:
+            del _FLOW_CACHE[stale]
+        flow = _FLOW_CACHE[key] = Flow.from_client_config(
+            client_config, scopes=scopes, redirect_uri=redirect_uri
+        )
+    return flow
+
 class GmailAPI:
     """Gmail API wrapper for OAuth2 authentication and operations."""
 
-    def __init__(self, credentials_file='credentials.json', token_file='token.pickle'):
+    # Gmail accepts up to 100 calls per batch, but throttles batches that
+    # large with per-request 429s
+    BATCH_SIZE = 50
+    # Seconds to wait before retrying batch requests that failed
+    BATCH_RETRY_DELAY = 1
+
+    def __init__(self, credentials_file='credentials.json', token_file='token.json', executor=None):
         self.credentials_file = credentials_file
-        self.token_file = token_file
-        self.service = None
+        # Tokens are stored as JSON; an older pickled token next to it is
+        # migrated on first load. A '.pickle' path is taken to mean the legacy file.
+        root, ext = os.path.splitext(token_file)
+        self.token_file = root + '.json' if ext == '.pickle' else token_file
+        self.legacy_token_file = root + '.pickle'
+        # Optional thread pool for fetching a message's large attachments
+        # concurrently; without one they are fetched inline
+        self.executor = executor
         self.creds = None
+        self._set_service(None)
+        self._client_info = None
+        self._client_mtime = None
+        self._registered_redirects = ()
+        self._preferred_redirect = None
 
     def authenticate(self):
         """Authenticate with Gmail API using OAuth2."""
-        creds = None
+        # Reuse the existing service while its token is comfortably valid
+        if self.service and self._token_valid():
+            return self.service
+
+        creds = self.creds
 
         # Load existing token
-        if os.path.exists(self.token_file):
-            with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
+        if not creds:
+            creds = self._load_credentials()
         # If credentials were found, refresh if necessary and return service
         if creds:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-
             self.creds = creds
-            self.service = build('gmail', 'v1', credentials=creds)
+            if not self._token_valid() and creds.refresh_token:
+                creds.refresh(Request(session=_HTTP_SESSION))
+                # Persist so the next process start doesn't refresh again
+                self._save_credentials(creds)
+
+            if not self.service:
+                self._set_service(build('gmail', 'v1', credentials=creds))
             return self.service
 
         # No saved credentials available — raise and let the app start the web OAuth flow
@@ -47,45 +117,118 @@ class GmailAPI:
             f"No saved token found ('{self.token_file}'). Start the OAuth web flow via the /gmail_auth route."
         )
 
-    def get_authorization_url(self, redirect_uri):
-        """Create an OAuth2 Flow for web application credentials and return the authorization URL and state.
+    def _set_service(self, service):
+        """Store the Gmail service along with its reusable resource objects."""
+        # Each users()/messages()/attachments() call builds a new Resource,
+        # so bind them once per service
+        self.service = service
+        self._users = service.users() if service else None
+        self._messages = self._users.messages() if service else None
+        self._attachments = self._messages.attachments() if service else None
+        # Per-thread HTTP clients were authorized for the previous service
+        self._local = threading.local()
+
+    def _token_valid(self):
+        """Check whether the access token stays valid beyond TOKEN_EXPIRY_BUFFER."""
+        creds = self.creds
+        if not creds or not creds.token or creds.expired:
+            return False
+        return creds.expiry is None or creds.expiry > datetime.utcnow() + TOKEN_EXPIRY_BUFFER
 
-        redirect_uri should be the full callback URL (example: https://yourhost/oauth2callback)
+    def _load_credentials(self):
+        """Load saved credentials, converting a legacy pickled token to JSON."""
+        if os.path.exists(self.token_file):
+            with open(self.token_file, 'r', encoding='utf-8') as token:
+                return Credentials.from_authorized_user_info(json.load(token), SCOPES)
+
+        if self.legacy_token_file != self.token_file and os.path.exists(self.legacy_token_file):
+            with open(self.legacy_token_file, 'rb') as token:
+                creds = pickle.load(token)
+            self._save_credentials(creds)
+            return creds
+
+        return None
+
+    def _save_credentials(self, creds):
+        """Save credentials to the token file."""
+        with open(self.token_file, 'w', encoding='utf-8') as token:
+            token.write(creds.to_json())
+
+    def for_thread(self, executor=None):
+        """Return a copy sharing these credentials with its own Gmail service.
+
+        The service's underlying httplib2.Http object is not thread-safe, so
+        each worker thread must use its own copy. Pass ``executor`` to let
+        several copies share one bounded pool for attachment fetches.
         """
-        if not os.path.exists(self.credentials_file):
-            raise FileNotFoundError(f"Credentials file '{self.credentials_file}' not found.")
+        if not self.service:
+            self.authenticate()
 
-        # Ensure the redirect_uri we use matches one of the URIs registered
-        # in the OAuth client (avoid redirect_uri_mismatch errors).
-        try:
+        api = GmailAPI(credentials_file=self.credentials_file, token_file=self.token_file,
+                       executor=executor)
+        api.creds = self.creds
+        api._set_service(build('gmail', 'v1', credentials=self.creds))
+        return api
+
+    def _load_client_info(self):
+        """Parse the OAuth client secrets file and cache it until its mtime changes."""
+        mtime = os.path.getmtime(self.credentials_file)
+        if self._client_info is None or mtime != self._client_mtime:
             with open(self.credentials_file, 'r', encoding='utf-8') as f:
                 client_info = json.load(f)
+
             registered_redirects = []
             # client JSON may have a top-level 'web' or 'installed' key
             for key in ('web', 'installed'):
                 if key in client_info and 'redirect_uris' in client_info[key]:
                     registered_redirects = client_info[key]['redirect_uris']
                     break
-            # If the provided redirect_uri isn't registered, fall back to the first registered one
-            if registered_redirects and redirect_uri not in registered_redirects:
-                # prefer localhost style if possible, otherwise first available
-                preferred = next((u for u in registered_redirects if 'localhost' in u), registered_redirects[0])
-                redirect_uri = preferred
+
+            self._registered_redirects = tuple(registered_redirects)
+            # prefer localhost style if possible, otherwise first available
+            self._preferred_redirect = next(
+                (u for u in registered_redirects if 'localhost' in u),
+                registered_redirects[0] if registered_redirects else None
+            )
+            self._client_info = client_info
+            self._client_mtime = mtime
+        return self._client_info
+
+    def _resolve_redirect_uri(self, redirect_uri):
+        """Return redirect_uri if it is registered for the client, else the preferred registered one."""
+        try:
+            self._load_client_info()
         except Exception:
             # If client file can't be parsed, continue with provided redirect_uri and let Flow handle errors
-            pass
+            return redirect_uri
 
-        flow = Flow.from_client_secrets_file(
-            self.credentials_file,
-            scopes=SCOPES,
-            redirect_uri=redirect_uri
-        )
+        # If the provided redirect_uri isn't registered, fall back to a registered one
+        if self._registered_redirects and redirect_uri not in self._registered_redirects:
+            return self._preferred_redirect
+        return redirect_uri
 
-        auth_url, state = flow.authorization_url(
-            access_type='offline',
-            include_granted_scopes='true',
-            prompt='consent'
-        )
+    def get_authorization_url(self, redirect_uri):
+        """Create an OAuth2 Flow for web application credentials and return the authorization URL and state.
+
+        redirect_uri should be the full callback URL (example: https://yourhost/oauth2callback)
+        """
+        if not os.path.exists(self.credentials_file):
+            raise FileNotFoundError(f"Credentials file '{self.credentials_file}' not found.")
+
+        # Ensure the redirect_uri we use matches one of the URIs registered
+        # in the OAuth client (avoid redirect_uri_mismatch errors).
+        redirect_uri = self._resolve_redirect_uri(redirect_uri)
+
+        client_info = self._load_client_info()
+        with _FLOW_CACHE_LOCK:
+            flow = _get_flow(self.credentials_file, self._client_mtime, client_info, SCOPES, redirect_uri)
+            # Every login gets its own PKCE verifier
+            flow.code_verifier = None
+            auth_url, state = flow.authorization_url(
+                access_type='offline',
+                include_granted_scopes='true',
+                prompt='consent'
+            )
 
         return auth_url, state
 
@@ -100,22 +243,10 @@ class GmailAPI:
             raise FileNotFoundError(f"Credentials file '{self.credentials_file}' not found.")
 
         # Ensure the redirect_uri used here matches a registered URI in the client
-        try:
-            with open(self.credentials_file, 'r', encoding='utf-8') as f:
-                client_info = json.load(f)
-            registered_redirects = []
-            for key in ('web', 'installed'):
-                if key in client_info and 'redirect_uris' in client_info[key]:
-                    registered_redirects = client_info[key]['redirect_uris']
-                    break
-            if registered_redirects and redirect_uri not in registered_redirects:
-                preferred = next((u for u in registered_redirects if 'localhost' in u), registered_redirects[0])
-                redirect_uri = preferred
-        except Exception:
-            pass
+        redirect_uri = self._resolve_redirect_uri(redirect_uri)
 
-        flow = Flow.from_client_secrets_file(
-            self.credentials_file,
+        flow = Flow.from_client_config(
+            self._load_client_info(),
             scopes=SCOPES,
             state=state,
             redirect_uri=redirect_uri
@@ -127,11 +258,10 @@ class GmailAPI:
         creds = flow.credentials
 
         # Save the credentials for the next run
-        with open(self.token_file, 'wb') as token:
-            pickle.dump(creds, token)
+        self._save_credentials(creds)
 
         self.creds = creds
-        self.service = build('gmail', 'v1', credentials=creds)
+        self._set_service(build('gmail', 'v1', credentials=creds))
         return self.service
 
     def get_messages(self, query='', max_results=100, label_ids=None):
@@ -140,7 +270,7 @@ class GmailAPI:
             self.authenticate()
 
         try:
-            result = self.service.users().messages().list(
+            result = self._messages.list(
                 userId='me',
                 q=query,
                 maxResults=max_results,
@@ -159,7 +289,7 @@ class GmailAPI:
             self.authenticate()
 
         try:
-            message = self.service.users().messages().get(
+            message = self._messages.get(
                 userId='me',
                 id=message_id,
                 format='full'
@@ -169,28 +299,127 @@ class GmailAPI:
             print(f'An error occurred: {error}')
             return None
 
-    def get_attachments(self, message_id):
-        """Get all attachments from a message."""
-        message = self.get_message_details(message_id)
+    def get_messages_details_batch(self, message_ids, format='full', metadata_headers=None):
+        """Get detailed information for many messages using batch requests.
+
+        Sends one HTTP request per BATCH_SIZE messages instead of one per
+        message. Messages that fail (e.g. rate-limited sub-requests) are
+        retried once after BATCH_RETRY_DELAY. Returns a tuple of two dicts:
+        message id to message, and message id to error message for messages
+        that still failed to load.
+        """
+        if not self.service:
+            self.authenticate()
+
+        messages = {}
+        failed = {}
+
+        def collector(request_id, response, exception):
+            if exception is not None:
+                print(f'An error occurred: {exception}')
+                failed[request_id] = str(exception)
+                return
+            messages[request_id] = response
+
+        pending = list(message_ids)
+        for attempt in range(2):
+            if attempt:
+                # Back off before retrying what failed the first time
+                time.sleep(self.BATCH_RETRY_DELAY)
+                failed.clear()
+
+            for start in range(0, len(pending), self.BATCH_SIZE):
+                chunk = pending[start:start + self.BATCH_SIZE]
+                batch = self.service.new_batch_http_request(callback=collector)
+                for message_id in chunk:
+                    batch.add(self._messages.get(
+                        userId='me',
+                        id=message_id,
+                        format=format,
+                        metadataHeaders=metadata_headers
+                    ), request_id=message_id)
+                try:
+                    batch.execute()
+                except HttpError as error:
+                    print(f'An error occurred: {error}')
+                    # The whole batch failed; report every message it had not answered
+                    for message_id in chunk:
+                        if message_id not in messages:
+                            failed.setdefault(message_id, str(error))
+
+            pending = list(failed)
+            if not pending:
+                break
+
+        return messages, failed
+
+    def get_message_headers_only(self, message_ids, headers=('From', 'Subject', 'Date')):
+        """Get selected headers for many messages without their bodies.
+
+        Uses format='metadata', so Gmail returns only the requested headers
+        instead of the full payload. Returns a tuple of a dict mapping message
+        id to a dict of lower-cased header names to values, and the failed
+        ids as returned by get_messages_details_batch.
+        """
+        messages, failed = self.get_messages_details_batch(
+            message_ids, format='metadata', metadata_headers=list(headers)
+        )
+        return {message_id: self.get_message_headers(message)
+                for message_id, message in messages.items()}, failed
+
+    def get_attachments(self, message_id, message=None):
+        """Get all attachments from a message.
+
+        Pass ``message`` when its full details were already fetched (e.g. via
+        get_messages_details_batch) to skip fetching it again. Attachments
+        that could not be fetched are returned with an ``error`` key instead
+        of ``data``.
+        """
+        if message is None:
+            message = self.get_message_details(message_id)
         if not message:
             return []
 
-        attachments = []
-        payload = message['payload']
+        # Walk the whole MIME tree (attachments can sit inside nested
+        # multipart/* parts) with an explicit stack instead of recursion.
+        # Children are pushed in reverse so parts come out in message order.
+        parts = []
+        stack = [message['payload']]
+        while stack:
+            part = stack.pop()
+            if part.get('filename'):
+                parts.append(part)
+            stack.extend(reversed(part.get('parts', ())))
 
-        # Process message parts
-        parts = [payload] if 'parts' not in payload else payload['parts']
+        if len(parts) > 1 and self.executor is not None:
+            # Large attachments each need their own request; run them concurrently
+            futures = [self.executor.submit(self._extract_attachment_info, part, message_id, True)
+                       for part in parts]
+            results = [future.result() for future in futures]
+        else:
+            results = [self._extract_attachment_info(part, message_id) for part in parts]
 
-        for part in parts:
-            if part.get('filename'):
-                attachment_info = self._extract_attachment_info(part, message_id)
-                if attachment_info:
-                    attachments.append(attachment_info)
+        return [attachment_info for attachment_info in results if attachment_info]
 
-        return attachments
+    def _thread_http(self):
+        """Return an authorized HTTP client owned by the current thread.
+
+        httplib2.Http is not thread-safe, so pool threads each keep their own
+        (and reuse its connection across fetches). The client is rebuilt
+        whenever the credentials have been replaced since it was made.
+        """
+        local = self._local
+        if getattr(local, 'http', None) is None or local.creds is not self.creds:
+            local.http = AuthorizedHttp(self.creds, http=httplib2.Http())
+            local.creds = self.creds
+        return local.http
 
-    def _extract_attachment_info(self, part, message_id):
-        """Extract attachment information from message part."""
+    def _extract_attachment_info(self, part, message_id, threaded=False):
+        """Extract attachment information from message part.
+
+        Set ``threaded`` when called from a pool thread so the attachment
+        request goes through that thread's own HTTP client.
+        """
         filename = part.get('filename')
         if not filename:
             return None
@@ -209,27 +438,30 @@ class GmailAPI:
             # Large attachment, need to fetch separately
             attachment_id = part['body']['attachmentId']
             try:
-                attachment = self.service.users().messages().attachments().get(
+                attachment = self._attachments.get(
                     userId='me',
                     messageId=message_id,
                     id=attachment_id
-                ).execute()
+                ).execute(http=self._thread_http() if threaded else None)
                 attachment_data['data'] = attachment['data']
             except HttpError as error:
                 print(f'Error fetching attachment: {error}')
-                return None
+                attachment_data['error'] = str(error)
 
         return attachment_data
 
     def download_attachment(self, attachment_data, save_path):
         """Download and save attachment to specified path."""
         try:
-            file_data = base64.urlsafe_b64decode(
-                attachment_data['data'].encode('UTF-8')
-            )
+            data = attachment_data['data'].translate(_URLSAFE_TO_STANDARD)
+            padding = '=' * (-len(data) % 4)
 
             with open(save_path, 'wb') as f:
-                f.write(file_data)
+                for start in range(0, len(data), DECODE_CHUNK_SIZE):
+                    chunk = data[start:start + DECODE_CHUNK_SIZE]
+                    if start + DECODE_CHUNK_SIZE >= len(data):
+                        chunk += padding
+                    f.write(binascii.a2b_base64(chunk))
 
             return True
         except Exception as error:
@@ -242,11 +474,8 @@ class GmailAPI:
 
     def get_message_headers(self, message):
         """Extract headers from message."""
-        headers = {}
-        if 'payload' in message and 'headers' in message['payload']:
-            for header in message['payload']['headers']:
-                headers[header['name'].lower()] = header['value']
-        return headers
+        payload = message.get('payload') or {}
+        return {header['name'].lower(): header['value'] for header in payload.get('headers', ())}
 
     def revoke_token(self):
         """Revoke the OAuth2 token and invalidate the access."""
@@ -256,15 +485,15 @@ class GmailAPI:
 
         try:
             # Revoke the token using Google's revocation endpoint
-            revoke_url = 'https://oauth2.googleapis.com/revoke'
-            import requests
-            response = requests.post(revoke_url, params={'token': self.creds.refresh_token})
+            response = _HTTP_SESSION.post(
+                REVOKE_URL, params={'token': self.creds.refresh_token}, timeout=5
+            )
 
             # Google returns 200 on success, 400 if token is invalid/expired
             if response.status_code in [200, 400]:
                 # Clear local credentials
                 self.creds = None
-                self.service = None
+                self._set_service(None)
                 return True
             else:
                 print(f"Token revocation failed with status: {response.status_code}")
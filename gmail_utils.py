@@ -2,8 +2,14 @@
 
 import os
 import re
-import math
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from types import MappingProxyType
+
+# Characters not allowed in stored filenames (includes the Windows path separator)
+_INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+_MULTISPACE = re.compile(r'\s+')
 
 def clean_filename(filename):
     """Clean filename for safe filesystem storage."""
@@ -11,8 +17,8 @@ def clean_filename(filename):
         return 'untitled'
 
     # Remove or replace invalid characters
-    filename = re.sub(r'[<>:"/\|?*]', '_', filename)
-    filename = re.sub(r'\s+', ' ', filename)  # Replace multiple spaces with single space
+    filename = _INVALID_FILENAME_CHARS.sub('_', filename)
+    filename = _MULTISPACE.sub(' ', filename)  # Replace multiple spaces with single space
     filename = filename.strip()
 
     # Ensure filename is not empty
@@ -26,98 +32,115 @@ def clean_filename(filename):
 
     return filename
 
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+
 def format_file_size(size_bytes):
     """Format file size in human readable format."""
-    if size_bytes == 0:
+    if size_bytes <= 0:
         return "0 B"
 
-    size_names = ["B", "KB", "MB", "GB", "TB"]
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(size_bytes / p, 2)
-    return f"{s} {size_names[i]}"
+    # Each unit is 2**10 times the previous, so the bit length picks the unit
+    i = min(max(0, (int(size_bytes).bit_length() - 1) // 10), len(_SIZE_UNITS) - 1)
+    s = round(float(size_bytes) / (1 << (10 * i)), 2)
+    return f"{s} {_SIZE_UNITS[i]}"
+
+# Bootstrap icon class per file type
+_FILE_ICON_MAP = MappingProxyType({
+    'pdf': 'bi-file-earmark-pdf',
+    'doc': 'bi-file-earmark-word',
+    'docx': 'bi-file-earmark-word',
+    'xls': 'bi-file-earmark-excel',
+    'xlsx': 'bi-file-earmark-excel',
+    'ppt': 'bi-file-earmark-ppt',
+    'pptx': 'bi-file-earmark-ppt',
+    'txt': 'bi-file-earmark-text',
+    'jpg': 'bi-file-earmark-image',
+    'jpeg': 'bi-file-earmark-image',
+    'png': 'bi-file-earmark-image',
+    'gif': 'bi-file-earmark-image',
+    'zip': 'bi-file-earmark-zip',
+    'rar': 'bi-file-earmark-zip',
+    '7z': 'bi-file-earmark-zip',
+    'mp3': 'bi-file-earmark-music',
+    'mp4': 'bi-file-earmark-play',
+    'avi': 'bi-file-earmark-play',
+})
 
 def get_file_icon(filetype):
     """Get Bootstrap icon class for file type."""
-    icon_map = {
-        'pdf': 'bi-file-earmark-pdf',
-        'doc': 'bi-file-earmark-word',
-        'docx': 'bi-file-earmark-word',
-        'xls': 'bi-file-earmark-excel',
-        'xlsx': 'bi-file-earmark-excel',
-        'ppt': 'bi-file-earmark-ppt',
-        'pptx': 'bi-file-earmark-ppt',
-        'txt': 'bi-file-earmark-text',
-        'jpg': 'bi-file-earmark-image',
-        'jpeg': 'bi-file-earmark-image',
-        'png': 'bi-file-earmark-image',
-        'gif': 'bi-file-earmark-image',
-        'zip': 'bi-file-earmark-zip',
-        'rar': 'bi-file-earmark-zip',
-        '7z': 'bi-file-earmark-zip',
-        'mp3': 'bi-file-earmark-music',
-        'mp4': 'bi-file-earmark-play',
-        'avi': 'bi-file-earmark-play',
-    }
-    return icon_map.get(filetype.lower(), 'bi-file-earmark')
-
-def build_search_query(sender=None, subject=None, date_after=None, 
-                       date_before=None, has_attachment=True, filename_contains=None):
-    """Build Gmail search query with multiple criteria."""
-    query_parts = []
-
-    if has_attachment:
-        query_parts.append('has:attachment')
-
-    if sender:
-        query_parts.append(f'from:{sender}')
+    return _FILE_ICON_MAP.get((filetype or '').lower(), 'bi-file-earmark')
 
-    if subject:
-        query_parts.append(f'subject:"{subject}"')
+def _format_query_date(value):
+    """Render a datetime in Gmail's query date format; other values pass through."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y/%m/%d')
+    return value
 
-    if date_after:
-        if isinstance(date_after, datetime):
-            date_after = date_after.strftime('%Y/%m/%d')
-        query_parts.append(f'after:{date_after}')
-
-    if date_before:
-        if isinstance(date_before, datetime):
-            date_before = date_before.strftime('%Y/%m/%d')
-        query_parts.append(f'before:{date_before}')
-
-    if filename_contains:
-        query_parts.append(f'filename:{filename_contains}')
-
-    return ' '.join(query_parts)
+def build_search_query(sender=None, subject=None, date_after=None,
+                       date_before=None, has_attachment=True, filename_contains=None):
+    """Build Gmail search query with multiple criteria."""
+    # Dates are stringified first so the cached builder only sees hashable, stable keys
+    return _build_search_query(sender, subject, _format_query_date(date_after),
+                               _format_query_date(date_before), has_attachment, filename_contains)
+
+@lru_cache(maxsize=256)
+def _build_search_query(sender, subject, date_after, date_before, has_attachment, filename_contains):
+    """Join the non-empty Gmail query parts."""
+    parts = (
+        'has:attachment' if has_attachment else None,
+        f'from:{sender}' if sender else None,
+        f'subject:"{subject}"' if subject else None,
+        f'after:{date_after}' if date_after else None,
+        f'before:{date_before}' if date_before else None,
+        f'filename:{filename_contains}' if filename_contains else None,
+    )
+    return ' '.join(part for part in parts if part)
 
 def parse_email_date(date_string):
-    """Parse email date string to datetime object."""
-    import email.utils
+    """Parse email date string to a naive UTC datetime object."""
     try:
-        date_tuple = email.utils.parsedate_tz(date_string)
-        if date_tuple:
-            timestamp = email.utils.mktime_tz(date_tuple)
-            return datetime.utcfromtimestamp(timestamp)
-    except:
-        pass
-    return None
+        parsed = parsedate_to_datetime(date_string)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is not None:
+        # Stored timestamps are naive UTC, like datetime.utcnow()
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 def extract_email_address(email_string):
     """Extract email address from 'Name <email@domain.com>' format."""
-    match = re.search(r'<([^>]+)>', email_string)
-    if match:
-        return match.group(1)
-    return email_string
+    if not email_string:
+        return email_string
+    # Plain str.find beats a regex search, and bare addresses skip it entirely
+    start = email_string.find('<')
+    if start == -1:
+        return email_string.strip()
+    end = email_string.find('>', start + 1)
+    if end > start + 1:
+        return email_string[start + 1:end]
+    return email_string.strip()
+
+# Search filters that do not depend on the current date
+_STATIC_SEARCH_FILTERS = {
+    'all': 'has:attachment',
+    'week': 'has:attachment newer_than:7d',
+    'month': 'has:attachment newer_than:30d',
+    'pdf': 'has:attachment filename:pdf',
+    'images': 'has:attachment filename:(jpg OR png OR gif)',
+    'documents': 'has:attachment filename:(doc OR docx OR xls OR xlsx OR ppt OR pptx)',
+    'large': 'has:attachment larger:5M'
+}
+
+@lru_cache(maxsize=1)
+def _search_filters_for_day(day_ordinal):
+    """Build the search filters for a given day (cached until the date changes)."""
+    today = date.fromordinal(day_ordinal).strftime("%Y/%m/%d")
+    return MappingProxyType({
+        'all': _STATIC_SEARCH_FILTERS['all'],
+        'today': f'has:attachment newer_than:{today}',
+        **_STATIC_SEARCH_FILTERS
+    })
 
 def get_search_filters():
-    """Get predefined search filters."""
-    return {
-        'all': 'has:attachment',
-        'today': f'has:attachment newer_than:{datetime.now().strftime("%Y/%m/%d")}',
-        'week': 'has:attachment newer_than:7d',
-        'month': 'has:attachment newer_than:30d',
-        'pdf': 'has:attachment filename:pdf',
-        'images': 'has:attachment filename:(jpg OR png OR gif)',
-        'documents': 'has:attachment filename:(doc OR docx OR xls OR xlsx OR ppt OR pptx)',
-        'large': 'has:attachment larger:5M'
-    }
+    """Get predefined search filters (read-only mapping)."""
+    return _search_filters_for_day(date.today().toordinal())
@@ -2,11 +2,32 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+import io
 from datetime import datetime
-from sqlalchemy import Index
+from sqlalchemy import Index, func, select
+from sqlalchemy.ext.hybrid import hybrid_property
 
 db = SQLAlchemy()
 
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+_IMAGE_TYPES = frozenset({'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg'})
+_DOC_TYPES = frozenset({'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'rtf'})
+_ARCHIVE_TYPES = frozenset({'zip', 'rar', '7z', 'tar', 'gz', 'bz2'})
+
+# On PostgreSQL, bulk inserts at least this large are loaded with COPY instead
+_COPY_THRESHOLD = 100
+_COPY_COLUMNS = (
+    'user_id', 'email_from', 'subject', 'filename', 'filepath',
+    'filetype', 'size', 'date_received', 'created_at', 'updated_at'
+)
+
+def _copy_value(value):
+    """Render a value in PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
 class User(UserMixin, db.Model):
     """User model for authentication."""
 
@@ -18,19 +39,33 @@ class User(UserMixin, db.Model):
     last_login = db.Column(db.DateTime)
     is_active = db.Column(db.Boolean, default=True)
 
-    # Relationships
-    attachments = db.relationship('Attachment', backref='owner', lazy=True, cascade='all, delete-orphan')
+    # Relationships (dynamic: user.attachments is a query, not a loaded list)
+    attachments = db.relationship('Attachment', backref='owner', lazy='dynamic', cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<User {self.email}>'
 
-    @property
+    @hybrid_property
     def attachment_count(self):
-        return len(self.attachments)
+        """Number of attachments, counted by the database."""
+        return self.attachments.count()
 
-    @property
+    @attachment_count.expression
+    def attachment_count(cls):
+        return select(func.count(Attachment.id)).where(
+            Attachment.user_id == cls.id
+        ).scalar_subquery()
+
+    @hybrid_property
     def total_size(self):
-        return sum(att.size for att in self.attachments if att.size)
+        """Total attachment size in bytes, summed by the database."""
+        return self.attachments.with_entities(func.coalesce(func.sum(Attachment.size), 0)).scalar()
+
+    @total_size.expression
+    def total_size(cls):
+        return select(func.coalesce(func.sum(Attachment.size), 0)).where(
+            Attachment.user_id == cls.id
+        ).scalar_subquery()
 
 class Attachment(db.Model):
     """Attachment model for downloaded files."""
@@ -46,7 +81,7 @@ class Attachment(db.Model):
     # File information
     filename = db.Column(db.String(500), nullable=False)
     filepath = db.Column(db.String(1000), nullable=False)
-    filetype = db.Column(db.String(50), index=True)
+    filetype = db.Column(db.String(50))
     size = db.Column(db.BigInteger, default=0)
 
     # Timestamps
@@ -56,17 +91,48 @@ class Attachment(db.Model):
     def __repr__(self):
         return f'<Attachment {self.filename}>'
 
+    @classmethod
+    def bulk_create(cls, rows):
+        """Insert attachment rows in a single round-trip.
+
+        ``rows`` is a list of plain dicts keyed by column name, e.g.
+        ``{'user_id': ..., 'filename': ..., 'filepath': ...}``. Large batches
+        on PostgreSQL are streamed through COPY; everything else uses one
+        executemany INSERT. The caller is responsible for committing.
+        """
+        if len(rows) >= _COPY_THRESHOLD and db.engine.dialect.name == 'postgresql':
+            cls._copy_rows(rows)
+        else:
+            db.session.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def _copy_rows(cls, rows):
+        """Load rows with COPY on the session's own connection."""
+        # COPY bypasses column defaults, so fill in the timestamps here
+        now = datetime.utcnow()
+        defaults = {'created_at': now, 'updated_at': now}
+
+        buf = io.StringIO()
+        for row in rows:
+            buf.write('\t'.join(_copy_value(row.get(col, defaults.get(col)))
+                                for col in _COPY_COLUMNS))
+            buf.write('\n')
+        buf.seek(0)
+
+        raw = db.session.connection().connection
+        with raw.cursor() as cur:
+            cur.copy_from(buf, cls.__tablename__, columns=_COPY_COLUMNS, sep='\t')
+
     @property
     def formatted_size(self):
         """Return human-readable file size."""
         if not self.size:
             return "0 B"
 
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if self.size < 1024.0:
-                return f"{self.size:.1f} {unit}"
-            self.size /= 1024.0
-        return f"{self.size:.1f} TB"
+        # Work on a local copy; assigning to self.size would dirty the row
+        size = int(self.size)
+        i = min((size.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+        return f"{size / (1 << (10 * i)):.1f} {_SIZE_UNITS[i]}"
 
     @property
     def file_extension(self):
@@ -76,23 +142,21 @@ class Attachment(db.Model):
     @property
     def is_image(self):
         """Check if file is an image."""
-        image_types = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg'}
-        return self.filetype.lower() in image_types
+        return (self.filetype or '').lower() in _IMAGE_TYPES
 
     @property
     def is_document(self):
         """Check if file is a document."""
-        doc_types = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'rtf'}
-        return self.filetype.lower() in doc_types
+        return (self.filetype or '').lower() in _DOC_TYPES
 
     @property
     def is_archive(self):
         """Check if file is an archive."""
-        archive_types = {'zip', 'rar', '7z', 'tar', 'gz', 'bz2'}
-        return self.filetype.lower() in archive_types
+        return (self.filetype or '').lower() in _ARCHIVE_TYPES
 
 # Database indexes for better performance
 Index('idx_attachment_user_date', Attachment.user_id, Attachment.created_at.desc())
 Index('idx_attachment_filename', Attachment.filename)
-Index('idx_attachment_type', Attachment.filetype)
+Index('idx_attachment_user_type_date', Attachment.user_id, Attachment.filetype,
+      Attachment.created_at.desc(), postgresql_include=['filename', 'size'])
 Index('idx_user_email', User.email)